@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from typing import Annotated
@@ -6,7 +7,10 @@ from typing import Annotated
 from app.models.auth import Token, LoginRequest
 from app.models.user import UserCreate, UserResponse, UserInDB
 from app.core.database import JSONDatabase
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core.security import (
+    verify_password_async, get_password_hash, get_password_hash_async,
+    create_access_token, password_needs_rehash,
+)
 from app.core.exceptions import UnauthorizedException, ConflictException
 from app.config import settings
 from app.dependencies import get_current_active_user
@@ -16,6 +20,13 @@ from datetime import datetime
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+# สร้าง DB handle ครั้งเดียวตอน import แล้ว reuse ทุก request
+users_db = JSONDatabase("users.json")
+
+# hash ปลอมสำหรับกรณีหา user ไม่เจอ: ยัง verify หนึ่งครั้งเสมอ
+# ให้เวลาตอบใกล้เคียง case รหัสผ่านผิด ป้องกัน username enumeration ผ่าน timing
+_DUMMY_PASSWORD_HASH = get_password_hash("dummy-password-for-timing")
+
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(user: UserCreate):
     """
@@ -26,15 +37,13 @@ async def register(user: UserCreate):
     - **password**: รหัสผ่าน (ขั้นต่ำ 6 ตัวอักษร)
     - **full_name**: ชื่อเต็ม (optional)
     """
-    db = JSONDatabase("users.json")
-    
     # ตรวจสอบว่า username ซ้ำไหม
-    existing_user = await db.get_by_field("username", user.username)
+    existing_user = await users_db.get_by_field("username", user.username)
     if existing_user:
         raise ConflictException(f"Username '{user.username}' already exists")
     
     # ตรวจสอบว่า email ซ้ำไหม
-    existing_email = await db.get_by_field("email", user.email)
+    existing_email = await users_db.get_by_field("email", user.email)
     if existing_email:
         raise ConflictException(f"Email '{user.email}' already registered")
     
@@ -44,16 +53,18 @@ async def register(user: UserCreate):
         "username": user.username,
         "email": user.email,
         "full_name": user.full_name,
-        "hashed_password": get_password_hash(user.password),
+        "hashed_password": await get_password_hash_async(user.password),
         "role": "user",  # default role
         "is_active": True,
         "created_at": datetime.utcnow().isoformat(),
         "updated_at": None
     }
     
-    await db.create(user_data)
-    
-    return UserResponse(**user_data)
+    await users_db.create(user_data)
+
+    # ข้อมูลเพิ่งสร้างเอง ผ่าน validation ของ UserCreate มาแล้ว
+    # ใช้ model_construct ข้ามการ validate ซ้ำ (field แปลกปลอมถูกตัดทิ้ง)
+    return UserResponse.model_construct(**user_data)
 
 @router.post("/login", response_model=Token)
 async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
@@ -63,21 +74,27 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     - **username**: ชื่อผู้ใช้
     - **password**: รหัสผ่าน
     """
-    db = JSONDatabase("users.json")
-    
     # หา user
-    user_data = await db.get_by_field("username", form_data.username)
+    user_data = await users_db.get_by_field("username", form_data.username)
     if not user_data:
+        # verify กับ hash ปลอมให้เสียเวลาเท่า case ปกติ
+        await verify_password_async(form_data.password, _DUMMY_PASSWORD_HASH)
         raise UnauthorizedException("Incorrect username or password")
     
     # ตรวจสอบรหัสผ่าน
-    if not verify_password(form_data.password, user_data["hashed_password"]):
+    if not await verify_password_async(form_data.password, user_data["hashed_password"]):
         raise UnauthorizedException("Incorrect username or password")
     
     # ตรวจสอบว่า active อยู่ไหม
     if not user_data.get("is_active", True):
         raise UnauthorizedException("User account is inactive")
     
+    # hash เก่าแบบ SHA256: upgrade เป็น bcrypt ด้วยรหัสผ่านที่เพิ่งผ่านการตรวจ
+    if password_needs_rehash(user_data["hashed_password"]):
+        await users_db.update(user_data["id"], {
+            "hashed_password": await get_password_hash_async(form_data.password)
+        })
+    
     # สร้าง access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -95,18 +112,24 @@ async def login_json(login_data: LoginRequest):
     - **username**: ชื่อผู้ใช้
     - **password**: รหัสผ่าน
     """
-    db = JSONDatabase("users.json")
-    
-    user_data = await db.get_by_field("username", login_data.username)
+    user_data = await users_db.get_by_field("username", login_data.username)
     if not user_data:
+        # verify กับ hash ปลอมให้เสียเวลาเท่า case ปกติ
+        await verify_password_async(login_data.password, _DUMMY_PASSWORD_HASH)
         raise UnauthorizedException("Incorrect username or password")
     
-    if not verify_password(login_data.password, user_data["hashed_password"]):
+    if not await verify_password_async(login_data.password, user_data["hashed_password"]):
         raise UnauthorizedException("Incorrect username or password")
     
     if not user_data.get("is_active", True):
         raise UnauthorizedException("User account is inactive")
     
+    # hash เก่าแบบ SHA256: upgrade เป็น bcrypt ด้วยรหัสผ่านที่เพิ่งผ่านการตรวจ
+    if password_needs_rehash(user_data["hashed_password"]):
+        await users_db.update(user_data["id"], {
+            "hashed_password": await get_password_hash_async(login_data.password)
+        })
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user_data["username"]},
@@ -115,12 +138,13 @@ async def login_json(login_data: LoginRequest):
     
     return {"access_token": access_token, "token_type": "bearer"}
 
-@router.get("/me", response_model=UserResponse)
+@router.get("/me", response_model=None)
 async def get_me(current_user: UserInDB = Depends(get_current_active_user)):
     """
     ดูข้อมูลโปรไฟล์ตัวเอง (ต้อง login)
     """
-    return UserResponse(**current_user.dict())
+    # payload ถูก memoize บน instance — poll /me ซ้ำๆ ไม่เสีย serialize ใหม่
+    return ORJSONResponse(current_user.response_payload())
 
 @router.post("/refresh", response_model=Token)
 async def refresh_token(current_user: UserInDB = Depends(get_current_active_user)):
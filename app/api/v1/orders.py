@@ -1,5 +1,8 @@
+import logging
+
 from fastapi import APIRouter, Depends, Query, status
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from typing import Optional
 
 from app.models.order import OrderCreate, OrderResponse, OrderUpdateStatus, OrderInDB
 from app.models.user import UserInDB
@@ -8,11 +11,19 @@ from app.core.exceptions import NotFoundException, BadRequestException, Forbidde
 from app.dependencies import get_current_active_user, get_current_admin_user
 
 import uuid
+from collections import Counter
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/orders", tags=["Orders"])
 
-@router.get("", response_model=List[OrderResponse])
+# สร้าง DB handles ครั้งเดียวตอน import แล้ว reuse ทุก request
+orders_db = JSONDatabase("orders.json")
+products_db = JSONDatabase("products.json")
+
+# คืน ORJSONResponse ตรงๆ — ปิด response_model จะได้ไม่เสีย pass validate/serialize ซ้ำ
+@router.get("", response_model=None)
 async def get_orders(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
@@ -25,29 +36,24 @@ async def get_orders(
     - User ทั่วไปดูได้เฉพาะ order ตัวเอง
     - Admin ดูได้ทั้งหมด
     """
-    db = JSONDatabase("orders.json")
     
     # CRITICAL: ต้องตรวจสอบ role และกรอง user_id อย่างถูกต้อง
-    if current_user.role == "admin":
-        # Admin เท่านั้นที่ดูได้ทั้งหมด
-        orders = await db.get_all()
-        print(f"[ADMIN] User {current_user.username} requested all orders: {len(orders)} found")
-    else:
-        # User ธรรมดาต้องดูเฉพาะของตัวเอง
-        orders = await db.filter(user_id=current_user.id)
-        print(f"[USER] User {current_user.username} (ID: {current_user.id}) requested orders: {len(orders)} found")
-    
+    filters = {}
+    if current_user.role != "admin":
+        # User ธรรมดาต้องดูเฉพาะของตัวเอง (admin เท่านั้นที่ดูได้ทั้งหมด)
+        filters["user_id"] = current_user.id
+
     # Filter by status ถ้ามี
     if status:
-        orders = [o for o in orders if o.get("status") == status]
-    
-    # Pagination
-    total_before_pagination = len(orders)
-    orders = orders[skip : skip + limit]
-    
-    print(f"[RESPONSE] Returning {len(orders)} orders (total: {total_before_pagination})")
-    
-    return [OrderResponse(**order) for order in orders]
+        filters["status"] = status
+
+    # กรอง + แบ่งหน้าใน pass เดียว
+    orders = await orders_db.query(filters=filters, skip=skip, limit=limit)
+
+    logger.debug("User %s (%s): returning %d orders", current_user.username, current_user.role, len(orders))
+
+    # ข้อมูลจาก DB ของเราเองเป็น JSON-safe dict อยู่แล้ว ส่งตรงๆ ได้เลย
+    return ORJSONResponse(orders)
 
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_order(
@@ -60,18 +66,17 @@ async def get_order(
     - User ทั่วไปดูได้เฉพาะ order ตัวเอง
     - Admin ดูได้ทั้งหมด
     """
-    db = JSONDatabase("orders.json")
-    order = await db.get_by_id(order_id)
+    order = await orders_db.get_by_id(order_id)
     
     if not order:
         raise NotFoundException(f"Order with id {order_id} not found")
     
     # CRITICAL: ตรวจสอบสิทธิ์
     if current_user.role != "admin" and order["user_id"] != current_user.id:
-        print(f"[FORBIDDEN] User {current_user.username} (ID: {current_user.id}) tried to access order {order_id} (owner: {order['user_id']})")
+        logger.warning("User %s (ID: %s) tried to access order %s (owner: %s)", current_user.username, current_user.id, order_id, order['user_id'])
         raise ForbiddenException("Not enough permissions to view this order")
     
-    print(f"[ACCESS GRANTED] User {current_user.username} accessed order {order_id}")
+    logger.debug("User %s accessed order %s", current_user.username, order_id)
     return OrderResponse(**order)
 
 @router.post("", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
@@ -82,24 +87,32 @@ async def create_order(
     """
     สร้าง order ใหม่ (ต้อง login)
     """
-    db_products = JSONDatabase("products.json")
-    db_orders = JSONDatabase("orders.json")
     
-    # ตรวจสอบสินค้าและ stock
+    # รวมจำนวนต่อสินค้าก่อน — order ที่มีสินค้าตัวเดียวกันหลาย item
+    # ต้องตรวจและหัก stock จากยอดรวม ไม่ใช่ทีละ item แยกกัน
+    quantities = Counter()
     total_amount = 0
     for item in order.items:
-        product = await db_products.get_by_id(item.product_id)
-        
+        quantities[item.product_id] += item.quantity
+        total_amount += item.quantity * item.price
+
+    # ตรวจสอบสินค้าและ stock (ดึงสินค้าทุกตัวครั้งเดียว ไม่ lookup ทีละ item)
+    products = await products_db.get_many_by_ids(list(quantities))
+
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+
         if not product:
-            raise BadRequestException(f"Product {item.product_id} not found")
-        
-        if product["stock"] < item.quantity:
+            raise BadRequestException(f"Product {product_id} not found")
+
+        if product["stock"] < quantity:
             raise BadRequestException(
                 f"Insufficient stock for product {product['name']}. Available: {product['stock']}"
             )
-        
-        total_amount += item.quantity * item.price
     
+    # timestamp เดียวใช้ทั้ง order และ stock updates ทุกตัว
+    now = datetime.utcnow().isoformat()
+
     # CRITICAL: ใช้ user_id จาก current_user (token) ไม่ใช่จาก request
     order_data = {
         "id": str(uuid.uuid4()),
@@ -107,22 +120,26 @@ async def create_order(
         "items": [item.dict() for item in order.items],
         "status": "pending",
         "total_amount": total_amount,
-        "created_at": datetime.utcnow().isoformat(),
+        "created_at": now,
         "updated_at": None
     }
     
-    print(f"[ORDER CREATED] User {current_user.username} (ID: {current_user.id}) created order {order_data['id']}")
+    logger.info("User %s (ID: %s) created order %s", current_user.username, current_user.id, order_data['id'])
     
-    # ลด stock
-    for item in order.items:
-        product = await db_products.get_by_id(item.product_id)
-        new_stock = product["stock"] - item.quantity
-        await db_products.update(item.product_id, {
-            "stock": new_stock,
-            "updated_at": datetime.utcnow().isoformat()
-        })
-    
-    await db_orders.create(order_data)
+    # ลด stock + บันทึก order เป็น transaction เดียว
+    # ถ้าพังกลางทาง stock ที่หักไปแล้วจะ rollback ไม่ค้างครึ่งๆ กลางๆ
+    async with products_db.batch(), orders_db.batch():
+        updates = [
+            (product_id, {
+                "stock": products[product_id]["stock"] - quantity,
+                "updated_at": now
+            })
+            for product_id, quantity in quantities.items()
+        ]
+        await products_db.bulk_update(updates)
+
+        await orders_db.create(order_data)
+
     return OrderResponse(**order_data)
 
 @router.patch("/{order_id}/status", response_model=OrderResponse)
@@ -134,20 +151,19 @@ async def update_order_status(
     """
     อัพเดทสถานะ order (เฉพาะ admin)
     """
-    db = JSONDatabase("orders.json")
-    order = await db.get_by_id(order_id)
+    order = await orders_db.get_by_id(order_id)
     
     if not order:
         raise NotFoundException(f"Order with id {order_id} not found")
     
-    print(f"[STATUS UPDATE] Admin {current_user.username} changed order {order_id} status to {status_update.status}")
+    logger.info("Admin %s changed order %s status to %s", current_user.username, order_id, status_update.status)
     
     update_data = {
         "status": status_update.status,
         "updated_at": datetime.utcnow().isoformat()
     }
     
-    updated_order = await db.update(order_id, update_data)
+    updated_order = await orders_db.update(order_id, update_data)
     return OrderResponse(**updated_order)
 
 @router.delete("/{order_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -161,10 +177,8 @@ async def cancel_order(
     - User ทั่วไปยกเลิกได้เฉพาะ order ตัวเอง (ถ้ายังเป็น pending)
     - Admin ยกเลิกได้ทั้งหมด
     """
-    db_orders = JSONDatabase("orders.json")
-    db_products = JSONDatabase("products.json")
     
-    order = await db_orders.get_by_id(order_id)
+    order = await orders_db.get_by_id(order_id)
     
     if not order:
         raise NotFoundException(f"Order with id {order_id} not found")
@@ -173,28 +187,40 @@ async def cancel_order(
     if current_user.role != "admin":
         # User ธรรมดาต้องตรวจสอบ 2 อย่าง
         if order["user_id"] != current_user.id:
-            print(f"[FORBIDDEN] User {current_user.username} tried to cancel order {order_id} (not owner)")
+            logger.warning("User %s tried to cancel order %s (not owner)", current_user.username, order_id)
             raise ForbiddenException("Not enough permissions to cancel this order")
         
         if order["status"] != "pending":
             raise BadRequestException("Can only cancel pending orders")
     
-    print(f"[ORDER CANCELLED] User {current_user.username} cancelled order {order_id}")
+    logger.info("User %s cancelled order %s", current_user.username, order_id)
     
-    # คืน stock
-    for item in order["items"]:
-        product = await db_products.get_by_id(item["product_id"])
-        if product:
-            new_stock = product["stock"] + item["quantity"]
-            await db_products.update(item["product_id"], {
-                "stock": new_stock,
-                "updated_at": datetime.utcnow().isoformat()
+    # timestamp เดียวใช้ทั้งการคืน stock และการเปลี่ยนสถานะ
+    now = datetime.utcnow().isoformat()
+
+    # คืน stock + เปลี่ยนสถานะเป็น transaction เดียว (rollback ถ้าพังกลางทาง)
+    async with products_db.batch(), orders_db.batch():
+        # รวมจำนวนคืนต่อสินค้า แล้วดึงสินค้าทุกตัวในครั้งเดียว
+        # (สินค้าตัวเดียวกันหลาย item ต้องคืน stock รวมทุก item)
+        refunds = Counter()
+        for item in order["items"]:
+            refunds[item["product_id"]] += item["quantity"]
+        products = await products_db.get_many_by_ids(list(refunds))
+        updates = [
+            (product_id, {
+                "stock": products[product_id]["stock"] + quantity,
+                "updated_at": now
             })
-    
-    # อัพเดทสถานะเป็น cancelled
-    await db_orders.update(order_id, {
-        "status": "cancelled",
-        "updated_at": datetime.utcnow().isoformat()
-    })
-    
+            for product_id, quantity in refunds.items()
+            if product_id in products
+        ]
+        if updates:
+            await products_db.bulk_update(updates)
+
+        # อัพเดทสถานะเป็น cancelled
+        await orders_db.update(order_id, {
+            "status": "cancelled",
+            "updated_at": now
+        })
+
     return None
\ No newline at end of file
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, Query, status
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from typing import Optional
 
 from app.models.product import ProductCreate, ProductUpdate, ProductResponse, ProductInDB
 from app.models.user import UserInDB
@@ -12,7 +13,11 @@ from datetime import datetime
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
-@router.get("", response_model=List[ProductResponse])
+# สร้าง DB handle ครั้งเดียวตอน import แล้ว reuse ทุก request
+products_db = JSONDatabase("products.json")
+
+# คืน ORJSONResponse ตรงๆ — ปิด response_model จะได้ไม่เสีย pass validate/serialize ซ้ำ
+@router.get("", response_model=None)
 async def get_products(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
@@ -29,33 +34,31 @@ async def get_products(
     - **min_price**: ราคาขั้นต่ำ
     - **max_price**: ราคาสูงสุด
     """
-    db = JSONDatabase("products.json")
-    
-    products = await db.get_all()
-    
-    # Filter by category
+    # เคสที่เจอบ่อยสุดคือไม่มี filter เลย — ตัด slice จากหน่วยความจำตรงๆ O(limit)
+    if category is None and min_price is None and max_price is None:
+        return ORJSONResponse(await products_db.slice(skip, limit))
+
+    # รวมทุกเงื่อนไขไว้ใน pass เดียว ไม่สร้าง list กลางหลายรอบ
+    predicates = []
     if category:
-        products = [p for p in products if p.get("category") == category]
-    
-    # Filter by price range
+        predicates.append(lambda p: p.get("category") == category)
     if min_price is not None:
-        products = [p for p in products if p.get("price", 0) >= min_price]
-    
+        predicates.append(lambda p: p.get("price", 0) >= min_price)
     if max_price is not None:
-        products = [p for p in products if p.get("price", 0) <= max_price]
-    
-    # Pagination
-    products = products[skip : skip + limit]
-    
-    return [ProductResponse(**product) for product in products]
+        predicates.append(lambda p: p.get("price", 0) <= max_price)
+
+    products = await products_db.query(predicates=predicates, skip=skip, limit=limit)
+
+    # ข้อมูลจาก DB ของเราเองเป็น JSON-safe dict อยู่แล้ว
+    # ส่งผ่าน ORJSONResponse ตรงๆ ไม่ต้องผ่าน jsonable_encoder อีกรอบ
+    return ORJSONResponse(products)
 
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(product_id: str):
     """
     ดูรายละเอียดสินค้า (ไม่ต้อง login)
     """
-    db = JSONDatabase("products.json")
-    product = await db.get_by_id(product_id)
+    product = await products_db.get_by_id(product_id)
     
     if not product:
         raise NotFoundException(f"Product with id {product_id} not found")
@@ -70,8 +73,6 @@ async def create_product(
     """
     สร้างสินค้าใหม่ (เฉพาะ admin)
     """
-    db = JSONDatabase("products.json")
-    
     product_data = {
         "id": str(uuid.uuid4()),
         **product.dict(),
@@ -79,7 +80,7 @@ async def create_product(
         "updated_at": None
     }
     
-    await db.create(product_data)
+    await products_db.create(product_data)
     return ProductResponse(**product_data)
 
 @router.put("/{product_id}", response_model=ProductResponse)
@@ -91,8 +92,7 @@ async def update_product(
     """
     อัพเดทสินค้า (เฉพาะ admin)
     """
-    db = JSONDatabase("products.json")
-    product = await db.get_by_id(product_id)
+    product = await products_db.get_by_id(product_id)
     
     if not product:
         raise NotFoundException(f"Product with id {product_id} not found")
@@ -100,7 +100,7 @@ async def update_product(
     update_data = product_update.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.utcnow().isoformat()
     
-    updated_product = await db.update(product_id, update_data)
+    updated_product = await products_db.update(product_id, update_data)
     return ProductResponse(**updated_product)
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -111,11 +111,10 @@ async def delete_product(
     """
     ลบสินค้า (เฉพาะ admin)
     """
-    db = JSONDatabase("products.json")
-    product = await db.get_by_id(product_id)
+    product = await products_db.get_by_id(product_id)
     
     if not product:
         raise NotFoundException(f"Product with id {product_id} not found")
     
-    await db.delete(product_id)
+    await products_db.delete(product_id)
     return None
\ No newline at end of file
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, Query, status
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from typing import Optional
 
 from app.models.user import UserResponse, UserUpdate, UserInDB
 from app.core.database import JSONDatabase
@@ -9,7 +10,17 @@ from datetime import datetime
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
-@router.get("", response_model=List[UserResponse])
+# สร้าง DB handle ครั้งเดียวตอน import แล้ว reuse ทุก request
+users_db = JSONDatabase("users.json")
+
+# field ที่เปิดเผยใน list response — ชุดเดียวกับ UserResponse
+# เลือกแบบ allow-list: field ใหม่ใน DB จะไม่หลุดออกไปเองโดยไม่ตั้งใจ
+_USER_RESPONSE_KEYS = (
+    "id", "username", "email", "full_name", "role", "is_active", "created_at"
+)
+
+# คืน ORJSONResponse ตรงๆ — ปิด response_model จะได้ไม่เสีย pass validate/serialize ซ้ำ
+@router.get("", response_model=None)
 async def get_users(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
@@ -23,17 +34,15 @@ async def get_users(
     - **limit**: แสดงสูงสุดกี่รายการ
     - **role**: กรองตาม role (optional)
     """
-    db = JSONDatabase("users.json")
-    
-    if role:
-        users = await db.filter(role=role)
-    else:
-        users = await db.get_all()
-    
-    # Pagination
-    users = users[skip : skip + limit]
-    
-    return [UserResponse(**user) for user in users]
+    # กรอง + แบ่งหน้าใน pass เดียว
+    filters = {"role": role} if role else None
+    users = await users_db.query(filters=filters, skip=skip, limit=limit)
+
+    # ส่ง dict ตรงๆ ผ่าน ORJSONResponse — project เฉพาะ field ที่เปิดเผย
+    return ORJSONResponse([
+        {k: user.get(k) for k in _USER_RESPONSE_KEYS}
+        for user in users
+    ])
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(
@@ -46,8 +55,7 @@ async def get_user(
     - User ทั่วไปดูได้เฉพาะข้อมูลตัวเอง
     - Admin ดูได้ทั้งหมด
     """
-    db = JSONDatabase("users.json")
-    user = await db.get_by_id(user_id)
+    user = await users_db.get_by_id(user_id)
     
     if not user:
         raise NotFoundException(f"User with id {user_id} not found")
@@ -70,8 +78,7 @@ async def update_user(
     - User ทั่วไปแก้ไขได้เฉพาะข้อมูลตัวเอง
     - Admin แก้ไขได้ทั้งหมด
     """
-    db = JSONDatabase("users.json")
-    user = await db.get_by_id(user_id)
+    user = await users_db.get_by_id(user_id)
     
     if not user:
         raise NotFoundException(f"User with id {user_id} not found")
@@ -85,12 +92,12 @@ async def update_user(
     
     # ถ้ามีการเปลี่ยน password ให้ hash
     if "password" in update_data:
-        from app.core.security import get_password_hash
-        update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+        from app.core.security import get_password_hash_async
+        update_data["hashed_password"] = await get_password_hash_async(update_data.pop("password"))
     
     update_data["updated_at"] = datetime.utcnow().isoformat()
     
-    updated_user = await db.update(user_id, update_data)
+    updated_user = await users_db.update(user_id, update_data)
     return UserResponse(**updated_user)
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -101,8 +108,7 @@ async def delete_user(
     """
     ลบผู้ใช้ (เฉพาะ admin)
     """
-    db = JSONDatabase("users.json")
-    user = await db.get_by_id(user_id)
+    user = await users_db.get_by_id(user_id)
     
     if not user:
         raise NotFoundException(f"User with id {user_id} not found")
@@ -111,5 +117,5 @@ async def delete_user(
     if current_user.id == user_id:
         raise ForbiddenException("Cannot delete yourself")
     
-    await db.delete(user_id)
+    await users_db.delete(user_id)
     return None
\ No newline at end of file
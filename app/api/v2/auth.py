@@ -1,20 +1,35 @@
-from fastapi import APIRouter, Depends, status, Header
+from fastapi import APIRouter, BackgroundTasks, Depends, status, Header
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List
 from datetime import datetime, timedelta
 
 from app.models.auth import Token, LoginRequest
 from app.models.user import UserCreate, UserResponse, UserInDB
 from app.core.database import JSONDatabase
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core.security import (
+    verify_password_async, get_password_hash, get_password_hash_async,
+    create_access_token, password_needs_rehash,
+)
 from app.core.exceptions import UnauthorizedException, ConflictException, BadRequestException
 from app.config import settings
 from app.dependencies import get_current_active_user
 
+import re
 import uuid
 import httpx
 
 router = APIRouter(prefix="/auth", tags=["Authentication V2"])
 
+# สร้าง DB handle ครั้งเดียวตอน import แล้ว reuse ทุก request
+users_db = JSONDatabase("users.json")
+
+# hash ปลอมสำหรับกรณีหา user ไม่เจอ: ยัง verify หนึ่งครั้งเสมอ
+# ให้เวลาตอบใกล้เคียง case รหัสผ่านผิด ป้องกัน username enumeration ผ่าน timing
+_DUMMY_PASSWORD_HASH = get_password_hash("dummy-password-for-timing")
+
+# compile ครั้งเดียวตอน import — เร็วกว่า generator ไล่ทีละตัวอักษร
+_DIGIT_RE = re.compile(r"\d")
+
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_v2(user: UserCreate, user_agent: Optional[str] = Header(None)):
     """
@@ -25,15 +40,13 @@ async def register_v2(user: UserCreate, user_agent: Optional[str] = Header(None)
     - ส่ง welcome email (simulated)
     - Enhanced validation
     """
-    db = JSONDatabase("users.json")
-    
     # ตรวจสอบว่า username ซ้ำไหม
-    existing_user = await db.get_by_field("username", user.username)
+    existing_user = await users_db.get_by_field("username", user.username)
     if existing_user:
         raise ConflictException(f"Username '{user.username}' already exists")
     
     # ตรวจสอบว่า email ซ้ำไหม
-    existing_email = await db.get_by_field("email", user.email)
+    existing_email = await users_db.get_by_field("email", user.email)
     if existing_email:
         raise ConflictException(f"Email '{user.email}' already registered")
     
@@ -41,7 +54,7 @@ async def register_v2(user: UserCreate, user_agent: Optional[str] = Header(None)
     if len(user.password) < 8:
         raise BadRequestException("Password must be at least 8 characters")
     
-    if not any(char.isdigit() for char in user.password):
+    if _DIGIT_RE.search(user.password) is None:
         raise BadRequestException("Password must contain at least one digit")
     
     # สร้าง user ใหม่
@@ -50,7 +63,7 @@ async def register_v2(user: UserCreate, user_agent: Optional[str] = Header(None)
         "username": user.username,
         "email": user.email,
         "full_name": user.full_name,
-        "hashed_password": get_password_hash(user.password),
+        "hashed_password": await get_password_hash_async(user.password),
         "role": "user",
         "is_active": True,
         "created_at": datetime.utcnow().isoformat(),
@@ -60,16 +73,18 @@ async def register_v2(user: UserCreate, user_agent: Optional[str] = Header(None)
         "registered_from": user_agent or "Unknown"
     }
     
-    await db.create(user_data)
+    await users_db.create(user_data)
     
     # Simulate sending welcome email
     print(f"📧 [Simulated] Sending welcome email to {user.email}")
-    
-    return UserResponse(**user_data)
+
+    # ข้อมูลเพิ่งสร้างเอง ข้ามการ validate ซ้ำ (field แปลกปลอมถูกตัดทิ้ง)
+    return UserResponse.model_construct(**user_data)
 
 @router.post("/login", response_model=Token)
 async def login_v2(
     login_data: LoginRequest,
+    background_tasks: BackgroundTasks,
     user_agent: Optional[str] = Header(None)
 ):
     """
@@ -80,21 +95,27 @@ async def login_v2(
     - Track login count
     - Device tracking
     """
-    db = JSONDatabase("users.json")
-    
-    user_data = await db.get_by_field("username", login_data.username)
+    user_data = await users_db.get_by_field("username", login_data.username)
     if not user_data:
+        # verify กับ hash ปลอมให้เสียเวลาเท่า case ปกติ
+        await verify_password_async(login_data.password, _DUMMY_PASSWORD_HASH)
         raise UnauthorizedException("Incorrect username or password")
     
-    if not verify_password(login_data.password, user_data["hashed_password"]):
+    if not await verify_password_async(login_data.password, user_data["hashed_password"]):
         raise UnauthorizedException("Incorrect username or password")
     
     if not user_data.get("is_active", True):
         raise UnauthorizedException("User account is inactive")
     
-    # Update login info
+    # hash เก่าแบบ SHA256: upgrade เป็น bcrypt ด้วยรหัสผ่านที่เพิ่งผ่านการตรวจ
+    if password_needs_rehash(user_data["hashed_password"]):
+        await users_db.update(user_data["id"], {
+            "hashed_password": await get_password_hash_async(login_data.password)
+        })
+    
+    # Update login info หลังส่ง response แล้ว — client ไม่ต้องรอ write นี้
     login_count = user_data.get("login_count", 0) + 1
-    await db.update(user_data["id"], {
+    background_tasks.add_task(users_db.update, user_data["id"], {
         "last_login": datetime.utcnow().isoformat(),
         "login_count": login_count,
         "last_device": user_agent or "Unknown"
@@ -113,7 +134,7 @@ async def login_v2(
     
     return {"access_token": access_token, "token_type": "bearer"}
 
-@router.get("/me", response_model=dict)
+@router.get("/me", response_model=None)
 async def get_me_v2(current_user: UserInDB = Depends(get_current_active_user)):
     """
     ดูข้อมูลโปรไฟล์ตัวเอง (V2 - Enhanced with stats)
@@ -123,21 +144,21 @@ async def get_me_v2(current_user: UserInDB = Depends(get_current_active_user)):
     - Account age
     - Activity summary
     """
-    user_dict = current_user.dict()
-    
+    user_dict = current_user.dict(exclude={"hashed_password"})
+
     # Calculate account age
     created_at = datetime.fromisoformat(current_user.created_at)
     account_age_days = (datetime.utcnow() - created_at).days
-    
-    # Add statistics
+
+    # Add statistics แล้วส่งผ่าน ORJSONResponse ตรงๆ ไม่ผ่าน jsonable_encoder
     user_dict["statistics"] = {
         "account_age_days": account_age_days,
         "login_count": user_dict.get("login_count", 0),
         "last_login": user_dict.get("last_login"),
         "registered_from": user_dict.get("registered_from", "Unknown")
     }
-    
-    return user_dict
+
+    return ORJSONResponse(user_dict)
 
 @router.post("/logout")
 async def logout_v2(current_user: UserInDB = Depends(get_current_active_user)):
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, Query, status
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from typing import List, Literal, Optional
 from datetime import datetime
+import heapq
 
 from app.models.user import UserResponse, UserUpdate, UserInDB
 from app.core.database import JSONDatabase
@@ -9,14 +11,44 @@ from app.dependencies import get_current_active_user, get_current_admin_user
 
 router = APIRouter(prefix="/users", tags=["Users V2"])
 
-@router.get("", response_model=dict)
+# สร้าง DB handles ครั้งเดียวตอน import แล้ว reuse ทุก request
+users_db = JSONDatabase("users.json")
+orders_db = JSONDatabase("orders.json")
+
+# field ที่เปิดเผยใน list response — ชุดเดียวกับ UserResponse
+# เลือกแบบ allow-list: field ใหม่ใน DB จะไม่หลุดออกไปเองโดยไม่ตั้งใจ
+_USER_RESPONSE_KEYS = (
+    "id", "username", "email", "full_name", "role", "is_active", "created_at"
+)
+
+# cache field ที่ lower แล้วต่อ user สำหรับ search — ถ้าไม่ cache ทุก request
+# ที่ค้นหาจะสร้าง string ใหม่ 3 ตัวต่อแถว invalidate ด้วย data version
+_search_fields_cache: tuple = (-1, None)
+
+def _lowered_search_fields(users):
+    """dict จาก user id -> (username, email, full_name) ที่ lower แล้ว"""
+    global _search_fields_cache
+    version = users_db.data_version()
+    if _search_fields_cache[0] != version:
+        _search_fields_cache = (version, {
+            u["id"]: (
+                (u.get("username") or "").lower(),
+                (u.get("email") or "").lower(),
+                (u.get("full_name") or "").lower(),
+            )
+            for u in users
+        })
+    return _search_fields_cache[1]
+
+# คืน ORJSONResponse ตรงๆ — ไม่ต้องผ่าน jsonable_encoder + Pydantic ต่อ row
+@router.get("", response_model=None)
 async def get_users_v2(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
     role: Optional[str] = None,
     search: Optional[str] = None,
-    sort_by: str = Query("created_at", regex="^(created_at|username|email|login_count)$"),
-    order: str = Query("desc", regex="^(asc|desc)$"),
+    sort_by: Literal["created_at", "username", "email", "login_count"] = "created_at",
+    order: Literal["asc", "desc"] = "desc",
     current_user: UserInDB = Depends(get_current_admin_user)
 ):
     """
@@ -27,64 +59,89 @@ async def get_users_v2(
     - Sort by multiple fields
     - Better pagination with metadata
     """
-    db = JSONDatabase("users.json")
-    
-    users = await db.get_all()
-    
-    # Search filter
-    if search:
-        search_lower = search.lower()
-        users = [
-            u for u in users 
-            if search_lower in u.get("username", "").lower() 
-            or search_lower in u.get("email", "").lower()
-            or search_lower in u.get("full_name", "").lower()
-        ]
-    
-    # Role filter
-    if role:
-        users = [u for u in users if u.get("role") == role]
-    
-    # Sorting
-    reverse = (order == "desc")
-    users.sort(key=lambda x: x.get(sort_by, ""), reverse=reverse)
+    users = await users_db.get_all()
+
+    # รวม search + role filter ไว้ใน pass เดียว — เช็ค role (ถูกกว่า) ก่อน substring
+    if search or role:
+        search_lower = search.lower() if search else None
+        lowered = _lowered_search_fields(users) if search_lower is not None else None
+        filtered = []
+        for u in users:
+            if role and u.get("role") != role:
+                continue
+            if search_lower is not None and not any(
+                search_lower in field for field in lowered.get(u["id"], ())
+            ):
+                continue
+            filtered.append(u)
+        users = filtered
     
     # Count total before pagination
     total = len(users)
-    
-    # Pagination
-    users_page = users[skip : skip + limit]
-    
-    return {
-        "data": [UserResponse(**user) for user in users_page],
+
+    # Sorting + pagination: หน้าแรกๆ ของตารางใหญ่ใช้ partial sort
+    # O(N log k) พอ — ไม่ต้องเรียงทั้ง list เพื่อเอาแค่ skip+limit แถว
+    reverse = (order == "desc")
+    end = skip + limit
+
+    def sort_key(x):
+        return x.get(sort_by, "")
+
+    if end < total // 2:
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        users_page = select(end, users, key=sort_key)[skip:]
+    else:
+        users.sort(key=sort_key, reverse=reverse)
+        users_page = users[skip:end]
+    
+    return ORJSONResponse({
+        # ข้อมูลผ่าน validation ตอนเขียนแล้ว project เฉพาะ field ที่เปิดเผย
+        "data": [
+            {k: user.get(k) for k in _USER_RESPONSE_KEYS}
+            for user in users_page
+        ],
         "pagination": {
             "total": total,
             "skip": skip,
             "limit": limit,
             "pages": (total + limit - 1) // limit
         }
-    }
+    })
 
-@router.get("/stats", response_model=dict)
+# memoize ผลสถิติรวมตาม data version — คำนวณใหม่เฉพาะตอน users.json เปลี่ยน
+_stats_cache: tuple = (-1, None)
+
+@router.get("/stats", response_model=None)
 async def get_users_stats(
     current_user: UserInDB = Depends(get_current_admin_user)
 ):
     """
     ดูสถิติผู้ใช้ (V2 - New endpoint)
     """
-    db = JSONDatabase("users.json")
-    users = await db.get_all()
-    
-    total_users = len(users)
-    active_users = len([u for u in users if u.get("is_active", True)])
-    admin_users = len([u for u in users if u.get("role") == "admin"])
-    regular_users = len([u for u in users if u.get("role") == "user"])
-    
+    global _stats_cache
+    version = users_db.data_version()
+    if _stats_cache[0] == version:
+        return ORJSONResponse(_stats_cache[1])
+
+    users = await users_db.get_all()
+
+    # นับทุกสถิติใน pass เดียว แทน comprehension แยก 5 รอบ
+    total_users = active_users = admin_users = regular_users = total_logins = 0
+    for u in users:
+        total_users += 1
+        if u.get("is_active", True):
+            active_users += 1
+        role = u.get("role")
+        if role == "admin":
+            admin_users += 1
+        elif role == "user":
+            regular_users += 1
+        total_logins += u.get("login_count", 0)
+
     # Calculate average login count
-    total_logins = sum(u.get("login_count", 0) for u in users)
     avg_logins = total_logins / total_users if total_users > 0 else 0
-    
-    return {
+
+    stats = {
         "total_users": total_users,
         "active_users": active_users,
         "inactive_users": total_users - active_users,
@@ -93,8 +150,10 @@ async def get_users_stats(
         "average_logins_per_user": round(avg_logins, 2),
         "total_logins": total_logins
     }
+    _stats_cache = (version, stats)
+    return ORJSONResponse(stats)
 
-@router.get("/{user_id}/activity", response_model=dict)
+@router.get("/{user_id}/activity", response_model=None)
 async def get_user_activity(
     user_id: str,
     current_user: UserInDB = Depends(get_current_active_user)
@@ -105,8 +164,7 @@ async def get_user_activity(
     - User ทั่วไปดูได้เฉพาะข้อมูลตัวเอง
     - Admin ดูได้ทั้งหมด
     """
-    db = JSONDatabase("users.json")
-    user = await db.get_by_id(user_id)
+    user = await users_db.get_by_id(user_id)
     
     if not user:
         raise NotFoundException(f"User with id {user_id} not found")
@@ -116,21 +174,33 @@ async def get_user_activity(
         raise ForbiddenException("Not enough permissions to view this user's activity")
     
     # Get user's orders
-    db_orders = JSONDatabase("orders.json")
-    orders = await db_orders.filter(user_id=user_id)
-    
-    return {
+    orders = await orders_db.filter(user_id=user_id)
+
+    # นับสถานะ + ยอดใช้จ่ายใน pass เดียว
+    pending_orders = completed_orders = cancelled_orders = 0
+    total_spent = 0
+    for o in orders:
+        order_status = o.get("status")
+        if order_status == "pending":
+            pending_orders += 1
+        elif order_status == "completed":
+            completed_orders += 1
+        elif order_status == "cancelled":
+            cancelled_orders += 1
+        total_spent += o.get("total_amount", 0)
+
+    return ORJSONResponse({
         "user_id": user_id,
         "username": user["username"],
         "login_count": user.get("login_count", 0),
         "last_login": user.get("last_login"),
         "created_at": user["created_at"],
         "total_orders": len(orders),
-        "pending_orders": len([o for o in orders if o.get("status") == "pending"]),
-        "completed_orders": len([o for o in orders if o.get("status") == "completed"]),
-        "cancelled_orders": len([o for o in orders if o.get("status") == "cancelled"]),
-        "total_spent": sum(o.get("total_amount", 0) for o in orders)
-    }
+        "pending_orders": pending_orders,
+        "completed_orders": completed_orders,
+        "cancelled_orders": cancelled_orders,
+        "total_spent": total_spent
+    })
 
 @router.post("/{user_id}/deactivate")
 async def deactivate_user(
@@ -140,8 +210,7 @@ async def deactivate_user(
     """
     ปิดการใช้งานบัญชีผู้ใช้ (V2 - New endpoint)
     """
-    db = JSONDatabase("users.json")
-    user = await db.get_by_id(user_id)
+    user = await users_db.get_by_id(user_id)
     
     if not user:
         raise NotFoundException(f"User with id {user_id} not found")
@@ -149,7 +218,7 @@ async def deactivate_user(
     if current_user.id == user_id:
         raise BadRequestException("Cannot deactivate yourself")
     
-    await db.update(user_id, {
+    await users_db.update(user_id, {
         "is_active": False,
         "updated_at": datetime.utcnow().isoformat()
     })
@@ -164,13 +233,12 @@ async def activate_user(
     """
     เปิดการใช้งานบัญชีผู้ใช้ (V2 - New endpoint)
     """
-    db = JSONDatabase("users.json")
-    user = await db.get_by_id(user_id)
+    user = await users_db.get_by_id(user_id)
     
     if not user:
         raise NotFoundException(f"User with id {user_id} not found")
     
-    await db.update(user_id, {
+    await users_db.update(user_id, {
         "is_active": True,
         "updated_at": datetime.utcnow().isoformat()
     })
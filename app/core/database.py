@@ -1,79 +1,377 @@
-import json
-import os
+import orjson
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 import asyncio
+import os
 from app.config import settings
 
+
+class _FileState:
+    """ข้อมูล in-memory ของไฟล์หนึ่งไฟล์ แชร์กันทุก handle ที่ชี้ไฟล์เดียวกัน
+
+    ทุกการอ่านตอบจากหน่วยความจำ การเขียนแก้ในหน่วยความจำ (พร้อมอัพเดท index)
+    แล้วค่อย flush ลง disk แบบ debounce — write หลายครั้งติดๆ กัน
+    รวมเป็นการเขียนไฟล์ครั้งเดียว
+    """
+
+    FLUSH_DELAY = 0.05  # วินาที
+
+    def __init__(self, filepath: Path, indexed_fields: tuple, multi_indexed_fields: tuple = ()):
+        self.filepath = filepath
+        self.indexed_fields = indexed_fields
+        self.multi_indexed_fields = multi_indexed_fields
+        self.lock = asyncio.Lock()
+        self.dirty = False
+        self.batching = 0  # counter — batch ซ้อน/ขนานกันได้ ไม่ reset กันเอง
+        self.version = 0  # เพิ่มทุกครั้งที่ data เปลี่ยน — ใช้เป็น cache key ฝั่ง consumer
+        self._flush_handle = None
+        if filepath.exists():
+            self.rows: List[Dict[str, Any]] = orjson.loads(filepath.read_bytes())
+        else:
+            self.rows = []
+            self.dump()
+        self.rebuild_indexes()
+        self.mtime_ns = filepath.stat().st_mtime_ns
+
+    def rebuild_indexes(self):
+        """สร้าง index ทั้ง unique และ multi-valued ใหม่จาก rows (pass เดียว)"""
+        self.indexes: Dict[str, Dict[Any, Dict[str, Any]]] = {
+            field: {} for field in self.indexed_fields
+        }
+        self.multi_indexes: Dict[str, Dict[Any, List[Dict[str, Any]]]] = {
+            field: {} for field in self.multi_indexed_fields
+        }
+        for item in self.rows:
+            self.index_item(item)
+
+    def index_item(self, item: Dict[str, Any]):
+        """ใส่ record ลงทุก index"""
+        for field in self.indexed_fields:
+            value = item.get(field)
+            if value is not None:
+                self.indexes[field][value] = item
+        for field in self.multi_indexed_fields:
+            value = item.get(field)
+            if value is not None:
+                self.multi_indexes[field].setdefault(value, []).append(item)
+
+    def unindex_item(self, item: Dict[str, Any]):
+        """เอา record ออกจากทุก index"""
+        for field in self.indexed_fields:
+            value = item.get(field)
+            if value is not None and self.indexes[field].get(value) is item:
+                del self.indexes[field][value]
+        for field in self.multi_indexed_fields:
+            value = item.get(field)
+            bucket = self.multi_indexes[field].get(value)
+            if bucket is not None:
+                try:
+                    bucket.remove(item)
+                except ValueError:
+                    pass
+                if not bucket:
+                    del self.multi_indexes[field][value]
+
+    def dump(self):
+        """เขียน rows ลงไฟล์ (sync) — เขียนลง temp แล้ว os.replace ให้ atomic
+
+        dump รันบน worker thread ส่วน maybe_reload อ่านไฟล์จาก event loop
+        โดยไม่ถือ lock ถ้าเขียนทับไฟล์ตรงๆ ผู้อ่านอาจเจอไฟล์ครึ่งเดียว
+        replace ทำให้เห็นได้แค่เวอร์ชันเก่าหรือใหม่ครบไฟล์เท่านั้น
+        """
+        tmp_path = self.filepath.with_name(self.filepath.name + ".tmp")
+        tmp_path.write_bytes(orjson.dumps(
+            self.rows, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        ))
+        os.replace(tmp_path, self.filepath)
+        self.mtime_ns = self.filepath.stat().st_mtime_ns
+
+    def maybe_reload(self):
+        """reload จาก disk ถ้าไฟล์ถูกแก้จากภายนอก (เทียบ mtime_ns)
+
+        เคสนี้เกิดตอนมีคนแก้ไฟล์ data ตรงๆ ระหว่าง server รัน
+        (เช่น scripts/rehash_passwords.py) — ปกติ stat อย่างเดียว ไม่แตะไฟล์
+        """
+        if self.dirty or self.batching:
+            # มี write ของเราเองที่ยังไม่ flush — in-memory คือ source of truth
+            return
+        try:
+            mtime_ns = self.filepath.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns != self.mtime_ns:
+            self.rows = orjson.loads(self.filepath.read_bytes())
+            self.rebuild_indexes()
+            self.mtime_ns = mtime_ns
+            self.version += 1
+
+    def schedule_flush(self):
+        """นัด flush แบบ debounce หลังแก้ข้อมูล (เรียกขณะถือ lock อยู่)"""
+        self.dirty = True
+        self.version += 1
+        if self.batching:
+            # อยู่ใน batch: flush ครั้งเดียวตอนจบ batch แทน
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(
+            self.FLUSH_DELAY, lambda: loop.create_task(self.flush())
+        )
+
+    async def flush(self):
+        """เขียนข้อมูลที่ค้างอยู่ลง disk"""
+        if self.batching:
+            # อยู่กลาง batch — ห้ามเขียนสถานะครึ่ง transaction ลง disk
+            # จะ flush ครั้งเดียวตอน batch นอกสุดจบ
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self.lock:
+            if not self.dirty:
+                return
+            await asyncio.to_thread(self.dump)
+            # เคลียร์หลัง dump สำเร็จ — ระหว่างเขียน reader ยังเห็น dirty
+            # และไม่ reload, ถ้า dump พังข้อมูลยังถูกนับว่าค้างอยู่
+            self.dirty = False
+
+
+# state แชร์ระดับ process ต่อไฟล์ — ทุก JSONDatabase instance
+# ที่ชี้ไฟล์เดียวกัน (เช่นใน lifespan กับใน router) เห็นข้อมูลชุดเดียวกัน
+_STATES: Dict[Path, _FileState] = {}
+
+
 class JSONDatabase:
-    """Simple JSON file-based database"""
-    
+    """Simple JSON file-based database
+
+    ข้อมูลทั้งไฟล์อยู่ในหน่วยความจำ การอ่านทุกแบบเป็น O(1)/O(N) บน
+    in-memory list/index ไม่แตะ disk ส่วนการเขียน write-through ลงไฟล์
+
+    ขอบเขตการออกแบบ: lab นี้ตั้งใจใช้ไฟล์ JSON ที่เปิดอ่าน/แก้ด้วยมือได้
+    เป็น storage จริงจึงยอมจ่าย O(N) ต่อการ flush หนึ่งครั้ง (debounce
+    ช่วยรวม write ติดๆ กันแล้ว) ถ้า data โตเกินหลักหมื่น record ค่อย
+    migrate ไป SQLite (WAL + index บน id/username/user_id) โดย API
+    async ของ class นี้ออกแบบให้สลับ backend ได้โดย router ไม่ต้องแก้
+    """
+
+    # ฟิลด์ unique ต่อไฟล์ที่ maintain index ไว้ให้ lookup เป็น O(1)
+    INDEXED = {
+        "users.json": ("id", "username", "email"),
+        "orders.json": ("id",),
+        "products.json": ("id",),
+    }
+
+    # ฟิลด์ไม่ unique ที่ query บ่อย — index เป็น value -> list ของ records
+    MULTI_INDEXED = {
+        "orders.json": ("user_id",),
+    }
+
     def __init__(self, filename: str):
         self.data_dir = Path(settings.DATA_DIR)
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.filepath = self.data_dir / filename
-        self._ensure_file_exists()
-    
-    def _ensure_file_exists(self):
-        """สร้างไฟล์ถ้ายังไม่มี"""
-        if not self.filepath.exists():
-            self._write([])
-    
-    def _read(self) -> List[Dict[str, Any]]:
-        """อ่านข้อมูลจากไฟล์"""
-        with open(self.filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
-    def _write(self, data: List[Dict[str, Any]]):
-        """เขียนข้อมูลลงไฟล์"""
-        with open(self.filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-    
+        self._indexed_fields = self.INDEXED.get(filename, ("id",))
+        self._multi_indexed_fields = self.MULTI_INDEXED.get(filename, ())
+        state = _STATES.get(self.filepath)
+        if state is None:
+            state = _FileState(
+                self.filepath, self._indexed_fields, self._multi_indexed_fields
+            )
+            _STATES[self.filepath] = state
+        self._state = state
+
+    def data_version(self) -> int:
+        """เลข version ของข้อมูลชุดปัจจุบัน (เปลี่ยนทุกครั้งที่ data เปลี่ยน)
+
+        ใช้เป็น key สำหรับ memoize ผลที่ derive จากข้อมูลทั้งไฟล์
+        เช่นสถิติรวม — ถ้า version เดิม ผลเดิมยังใช้ได้
+        """
+        self._state.maybe_reload()
+        return self._state.version
+
     async def get_all(self) -> List[Dict[str, Any]]:
-        """ดึงข้อมูลทั้งหมด (async)"""
-        await asyncio.sleep(0)  # จำลอง async operation
-        return self._read()
-    
+        """ดึงข้อมูลทั้งหมด (คืน copy ของ list จากหน่วยความจำ)"""
+        self._state.maybe_reload()
+        return list(self._state.rows)
+
+    async def slice(self, skip: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """ตัดช่วง skip:skip+limit จาก list ในหน่วยความจำ (ไม่กรองอะไรเลย)"""
+        self._state.maybe_reload()
+        end = None if limit is None else skip + limit
+        return self._state.rows[skip:end]
+
     async def get_by_id(self, id: str) -> Optional[Dict[str, Any]]:
-        """ดึงข้อมูลตาม ID"""
-        data = await self.get_all()
-        return next((item for item in data if item.get('id') == id), None)
-    
+        """ดึงข้อมูลตาม ID (O(1) ผ่าน index)"""
+        return await self.get_by_field('id', id)
+
+    async def get_many_by_ids(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """ดึงหลาย record ตาม id ในครั้งเดียว (คืน dict id -> record)"""
+        self._state.maybe_reload()
+        index = self._state.indexes['id']
+        return {id: index[id] for id in ids if id in index}
+
     async def get_by_field(self, field: str, value: Any) -> Optional[Dict[str, Any]]:
-        """ดึงข้อมูลตาม field ใดๆ"""
-        data = await self.get_all()
-        return next((item for item in data if item.get(field) == value), None)
-    
+        """ดึงข้อมูลตาม field ใดๆ (ใช้ index ถ้ามี)"""
+        self._state.maybe_reload()
+        if field in self._indexed_fields:
+            return self._state.indexes[field].get(value)
+        # field ที่ไม่ได้ทำ index ไว้ fallback เป็น scan
+        return next(
+            (item for item in self._state.rows if item.get(field) == value), None
+        )
+
     async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
         """สร้างข้อมูลใหม่"""
-        data = await self.get_all()
-        data.append(item)
-        self._write(data)
+        state = self._state
+        async with state.lock:
+            state.rows.append(item)
+            state.index_item(item)
+            state.schedule_flush()
         return item
-    
+
+    async def create_many(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """สร้างหลาย record ภายใต้ lock เดียว flush ครั้งเดียว"""
+        state = self._state
+        async with state.lock:
+            for item in items:
+                state.rows.append(item)
+                state.index_item(item)
+            state.schedule_flush()
+        return items
+
     async def update(self, id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """อัพเดทข้อมูล"""
-        data = await self.get_all()
-        for item in data:
-            if item.get('id') == id:
-                item.update(updates)
-                self._write(data)
-                return item
-        return None
-    
+        state = self._state
+        async with state.lock:
+            item = state.indexes['id'].get(id)
+            if item is None:
+                return None
+            # ฟิลด์ที่ index ไว้อาจเปลี่ยนค่า ต้อง reindex record นี้
+            state.unindex_item(item)
+            item.update(updates)
+            state.index_item(item)
+            state.schedule_flush()
+            return item
+
+    async def bulk_update(self, updates: List[tuple]) -> None:
+        """อัพเดทหลาย record ภายใต้ lock เดียว flush ครั้งเดียว
+
+        updates: list ของ (id, {field: value})
+        """
+        state = self._state
+        async with state.lock:
+            index = state.indexes['id']
+            for id, fields in updates:
+                item = index.get(id)
+                if item is not None:
+                    state.unindex_item(item)
+                    item.update(fields)
+                    state.index_item(item)
+            state.schedule_flush()
+
     async def delete(self, id: str) -> bool:
         """ลบข้อมูล"""
-        data = await self.get_all()
-        new_data = [item for item in data if item.get('id') != id]
-        if len(new_data) < len(data):
-            self._write(new_data)
+        state = self._state
+        async with state.lock:
+            item = state.indexes['id'].get(id)
+            if item is None:
+                return False
+            state.rows.remove(item)
+            state.unindex_item(item)
+            state.schedule_flush()
             return True
-        return False
-    
+
     async def filter(self, **conditions) -> List[Dict[str, Any]]:
         """กรองข้อมูลตามเงื่อนไข"""
-        data = await self.get_all()
-        result = data
+        self._state.maybe_reload()
+        result = self._state.rows
+        # ถ้ามีเงื่อนไขบน field ที่ทำ multi index ไว้ เริ่มจาก bucket เล็กๆ แทน
+        for field in self._multi_indexed_fields:
+            if field in conditions:
+                result = self._state.multi_indexes[field].get(conditions.pop(field), [])
+                break
         for key, value in conditions.items():
             result = [item for item in result if item.get(key) == value]
-        return result
\ No newline at end of file
+        return list(result)
+
+    async def query(
+        self,
+        *,
+        filters: Optional[Dict[str, Any]] = None,
+        predicates: Optional[List[Callable[[Dict[str, Any]], bool]]] = None,
+        skip: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """กรอง + แบ่งหน้าใน pass เดียว
+
+        - filters: เงื่อนไข field == value
+        - predicates: เงื่อนไขอื่นๆ เป็น callable(record) -> bool
+        - หยุด iterate ทันทีที่ได้ครบ skip + limit รายการ
+        """
+        self._state.maybe_reload()
+        rows = self._state.rows
+        if filters:
+            # เริ่ม scan จาก bucket ของ multi index ถ้าเงื่อนไขไหนมี index
+            filters = dict(filters)
+            for field in self._multi_indexed_fields:
+                if field in filters:
+                    rows = self._state.multi_indexes[field].get(filters.pop(field), [])
+                    break
+        needed = None if limit is None else skip + limit
+        result: List[Dict[str, Any]] = []
+        for item in rows:
+            if filters and any(item.get(k) != v for k, v in filters.items()):
+                continue
+            if predicates and not all(pred(item) for pred in predicates):
+                continue
+            result.append(item)
+            if needed is not None and len(result) >= needed:
+                break
+        return result[skip:]
+
+    @asynccontextmanager
+    async def batch(self):
+        """รวมหลาย write ในไฟล์นี้เป็น transaction เดียว
+
+        ระหว่าง block จะไม่ flush ลง disk, จบ block flush ครั้งเดียว
+        ถ้ามี exception ข้อมูลในหน่วยความจำ rollback กลับ snapshot
+        ก่อนเริ่ม batch — batch ซ้อนกันได้ flush ตอน batch นอกสุดจบ
+        """
+        state = self._state
+        async with state.lock:
+            snapshot = [dict(item) for item in state.rows]
+            was_dirty = state.dirty
+            state.batching += 1
+            # flush ที่ debounce ค้างจาก write ก่อนหน้า ห้าม fire กลาง batch
+            if state._flush_handle is not None:
+                state._flush_handle.cancel()
+                state._flush_handle = None
+        try:
+            yield self
+        except BaseException:
+            async with state.lock:
+                state.rows = snapshot
+                state.rebuild_indexes()
+                state.dirty = was_dirty
+                state.batching -= 1
+                state.version += 1
+            if state.dirty and not state.batching:
+                # write ก่อนเข้า batch ยังค้างอยู่ (handle โดน cancel ไปแล้ว)
+                await state.flush()
+            raise
+        async with state.lock:
+            state.batching -= 1
+        # no-op เองถ้า batch นอกยังเปิดอยู่
+        await state.flush()
+
+    async def flush(self):
+        """เขียน write ที่ค้างอยู่ลง disk ทันที"""
+        await self._state.flush()
+
+    @classmethod
+    async def flush_all(cls):
+        """flush ทุกไฟล์ที่มี write ค้างอยู่ (เรียกตอน shutdown)"""
+        for state in list(_STATES.values()):
+            await state.flush()
@@ -1,17 +1,65 @@
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+from typing import Dict, Optional
+import asyncio
+import bcrypt
 import hashlib
+import hmac
+import time
+import jwt
 from app.config import settings
 
+# Style rule: การเทียบ secret/hash/token ดิบๆ ในโมดูลนี้ (หรือที่เพิ่มทีหลัง
+# เช่น API key, refresh-token allow-list) ต้องใช้ hmac.compare_digest เสมอ
+# ห้ามใช้ == เพราะ short-circuit ตาม byte แรกที่ต่าง ทำให้วัด timing ได้
+# (ลายเซ็น JWT ผ่าน PyJWT ซึ่ง verify แบบ constant-time อยู่แล้ว)
+
+def _is_legacy_hash(hashed_password: str) -> bool:
+    """hash ยุคแรกเป็น SHA256 hex 64 ตัวอักษร (ไม่มี salt)"""
+    if len(hashed_password) != 64:
+        return False
+    try:
+        int(hashed_password, 16)
+        return True
+    except ValueError:
+        return False
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """ตรวจสอบรหัสผ่านด้วย SHA256"""
-    password_hash = hashlib.sha256(plain_password.encode()).hexdigest()
-    return password_hash == hashed_password
+    """ตรวจสอบรหัสผ่าน (bcrypt — ยังรองรับ hash SHA256 เดิม)
+
+    หมายเหตุ: จงใจไม่ cache ผลการ verify — path ที่ login แล้ว
+    (/refresh, /me ฯลฯ) ยืนยันตัวตนผ่าน token ใน get_current_user
+    อยู่แล้ว ไม่มีจุดไหน hash ซ้ำ การเก็บ credential ที่ verify แล้ว
+    ไว้ในหน่วยความจำจึงได้ไม่คุ้มเสีย
+    """
+    if _is_legacy_hash(hashed_password):
+        # hash เก่า: hashlib บน OpenSSL dispatch ไปใช้ SHA-NI ให้เอง
+        password_hash = hashlib.sha256(plain_password.encode()).hexdigest()
+        return hmac.compare_digest(password_hash, hashed_password)
+    try:
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    except ValueError:
+        return False
 
 def get_password_hash(password: str) -> str:
-    """เข้ารหัสรหัสผ่านด้วย SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """เข้ารหัสรหัสผ่านด้วย bcrypt (12 rounds)"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(12)).decode()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password เวอร์ชันสำหรับ endpoint async
+
+    bcrypt 12 rounds กิน CPU ราวๆ 100ms — รันตรงๆ จะ block event loop
+    ทั้ง worker ย้ายไป thread pool แทน (bcrypt ปล่อย GIL ระหว่างคำนวณ
+    thread จึงขนานกันได้จริง ไม่ต้องจ่ายค่า spawn/serialize ของ process pool)
+    """
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash เวอร์ชันสำหรับ endpoint async (รันใน thread pool)"""
+    return await asyncio.to_thread(get_password_hash, password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """hash นี้เป็นแบบ legacy ที่ควร rehash เป็น bcrypt หรือไม่"""
+    return _is_legacy_hash(hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """สร้าง JWT token"""
@@ -26,10 +74,24 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+# cache payload ที่ verify ลายเซ็นแล้ว — request ติดๆ กันจาก client เดิม
+# ไม่ต้องคำนวณ HMAC ซ้ำ (ตรวจ exp ใหม่ทุก hit อยู่ดี token หมดอายุไม่รอด)
+_TOKEN_CACHE_MAX = 1024
+_token_cache: Dict[str, dict] = {}
+
 def decode_token(token: str) -> Optional[dict]:
     """ถอดรหัส JWT token"""
+    payload = _token_cache.get(token)
+    if payload is not None:
+        if payload.get("exp", 0) > time.time():
+            return payload
+        del _token_cache[token]
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
-    except JWTError:
-        return None
\ No newline at end of file
+    except jwt.PyJWTError:
+        return None
+    if len(_token_cache) >= _TOKEN_CACHE_MAX:
+        # เต็มแล้วทิ้ง entry เก่าสุด (dict รักษาลำดับ insert)
+        del _token_cache[next(iter(_token_cache))]
+    _token_cache[token] = payload
+    return payload
\ No newline at end of file
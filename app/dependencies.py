@@ -1,6 +1,6 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from app.core.security import decode_token
 from app.core.database import JSONDatabase
 from app.core.exceptions import UnauthorizedException, ForbiddenException
@@ -8,6 +8,15 @@ from app.models.user import UserInDB
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+users_db = JSONDatabase("users.json")
+
+# cache UserInDB ที่ resolve แล้วต่อ token — key ด้วย data version ของ users.json
+# version เปลี่ยน (เช่นโดน deactivate) cache entry ใช้ไม่ได้ทันที ไม่ต้องรอ TTL
+# (ภายใน request เดียว FastAPI cache ผลของ dependency ให้อยู่แล้ว
+# ตัวนี้ช่วยข้าม lookup + validate ระหว่าง request ติดๆ กันของ client เดิม)
+_USER_CACHE_MAX = 1024
+_user_cache: Dict[str, Tuple[int, UserInDB]] = {}
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
     """ดึงข้อมูล user จาก token"""
     payload = decode_token(token)
@@ -19,14 +28,22 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
     if username is None:
         raise UnauthorizedException("Could not validate credentials")
     
+    version = users_db.data_version()
+    cached = _user_cache.get(token)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
     # ดึงข้อมูล user จาก database
-    db = JSONDatabase("users.json")
-    user_data = await db.get_by_field("username", username)
+    user_data = await users_db.get_by_field("username", username)
     
     if user_data is None:
         raise UnauthorizedException("User not found")
     
-    return UserInDB(**user_data)
+    user = UserInDB(**user_data)
+    if len(_user_cache) >= _USER_CACHE_MAX:
+        del _user_cache[next(iter(_user_cache))]
+    _user_cache[token] = (version, user)
+    return user
 
 async def get_current_active_user(
     current_user: UserInDB = Depends(get_current_user)
@@ -1,8 +1,11 @@
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
+import logging
+import logging.handlers
+import queue
 import time
 
 from app.config import settings
@@ -22,6 +25,15 @@ async def lifespan(app: FastAPI):
     """
     Startup and shutdown events
     """
+    # Logging: handler จริงอยู่หลัง queue — request thread แค่ enqueue
+    # ส่วน I/O ลง stdout ทำบน background thread ของ listener
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+
     # Startup
     print("Starting up FastAPI Lab...")
     print(f"App Name:\t{settings.APP_NAME}")
@@ -90,8 +102,8 @@ async def lifespan(app: FastAPI):
                 "created_at": datetime.utcnow().isoformat()
             },
         ]
-        for product in sample_products:
-            await db_products.create(product)
+        # insert ทีเดียวทั้งชุด — เขียนไฟล์ครั้งเดียวแทนสามครั้ง
+        await db_products.create_many(sample_products)
         print(f"Created {len(sample_products)} sample products")
     
     print("Startup complete!")
@@ -100,12 +112,16 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     print("Shutting down FastAPI Lab...")
+    # เขียน write ที่ยัง debounce ค้างอยู่ลง disk ก่อนปิด
+    await JSONDatabase.flush_all()
+    listener.stop()
 
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.VERSION,
     description="FastAPI Lab - Learning RESTful API with Authentication",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan,
     docs_url="/docs",
     redoc_url="/redoc"
@@ -123,10 +139,11 @@ app.add_middleware(
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
+    # perf_counter_ns: monotonic ไม่โดน NTP ปรับเวลา ไม่เสีย precision ของ float
+    start_time = time.perf_counter_ns()
     response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
+    elapsed_ms = (time.perf_counter_ns() - start_time) / 1e6
+    response.headers["X-Process-Time"] = f"{elapsed_ms:.2f}ms"
     return response
 
 # Exception handlers
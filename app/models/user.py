@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field, validator
+from pydantic import BaseModel, EmailStr, Field, PrivateAttr, validator
 from typing import Optional, Literal
 from datetime import datetime
 
@@ -29,6 +29,24 @@ class UserInDB(UserBase):
     created_at: str
     updated_at: Optional[str] = None
 
+    # memoize response dict ต่อ instance — /me เป็น endpoint ที่ frontend
+    # poll บ่อย และ instance ไม่ถูกแก้ไขหลังสร้าง จึง cache ได้ปลอดภัย
+    _response_payload: Optional[dict] = PrivateAttr(default=None)
+
+    def response_payload(self) -> dict:
+        """dict หน้าตาเดียวกับ UserResponse (คำนวณครั้งเดียวต่อ instance)"""
+        if self._response_payload is None:
+            self._response_payload = {
+                "id": self.id,
+                "username": self.username,
+                "email": self.email,
+                "full_name": self.full_name,
+                "role": self.role,
+                "is_active": self.is_active,
+                "created_at": self.created_at,
+            }
+        return self._response_payload
+
 class UserResponse(UserBase):
     id: str
     role: str
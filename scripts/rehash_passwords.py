@@ -5,10 +5,16 @@ from pathlib import Path
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash, password_needs_rehash
 
 def rehash_users_data():
-    """Re-hash passwords ในไฟล์ users.json"""
+    """Re-hash passwords ในไฟล์ users.json
+
+    migrate hash SHA256 เดิม (hex 64 ตัวอักษร) เป็น bcrypt —
+    entry ที่เป็น bcrypt อยู่แล้วจะถูกข้าม
+    (อีกทางคือไม่ต้องรันสคริปต์นี้เลย hash จะถูก upgrade เอง
+    ตอน user login สำเร็จครั้งถัดไป)
+    """
     
     users_file = Path("app/data/users.json")
     
@@ -25,6 +31,9 @@ def rehash_users_data():
     
     for user in users:
         username = user.get('username')
+        if not password_needs_rehash(user.get('hashed_password', '')):
+            print(f"Skipped (already bcrypt): {username}")
+            continue
         # สมมติว่า password เดิมคือ "password123" สำหรับทุกคน
         new_hash = get_password_hash("password123")
         user['hashed_password'] = new_hash